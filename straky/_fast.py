@@ -0,0 +1,156 @@
+"""
+Batch kernels over arrays of packed (int64) states.
+They are compiled with Numba when it is installed; otherwise Board falls back to NumPy / pure Python.
+"""
+import numpy as np
+
+try:
+	import numba
+except ImportError:
+	numba = None
+
+ENABLED = numba is not None
+
+
+def jit(f=None, **options):
+	if f is None:
+		return lambda f: jit(f, **options)
+	if numba is None:
+		return f
+	return numba.njit(cache=True, **options)(f)
+
+
+prange = numba.prange if numba is not None else range
+
+
+@jit
+def _unpack(s, digits):
+	nn = digits.shape[0]
+	for k in range(nn - 1, -1, -1):
+		digits[k] = s % 3
+		s //= 3
+
+
+@jit
+def get_winners_batch(states, n):
+	"""
+	Winner bitsets of an array of states: bit 0 is set if color 1 wins, bit 1 if color 2 wins.
+	"""
+	out = np.zeros(states.shape[0], dtype=np.uint8)
+	digits = np.empty(n*n, dtype=np.int64)
+	for b in range(states.shape[0]):
+		_unpack(states[b], digits)
+		for line in range(n):
+			# Row
+			v = digits[line*n]
+			for i in range(1, n):
+				if digits[line*n + i] != v:
+					v = 0
+					break
+			if v:
+				out[b] |= 1 << (v - 1)
+			# Column
+			v = digits[line]
+			for i in range(1, n):
+				if digits[line + i*n] != v:
+					v = 0
+					break
+			if v:
+				out[b] |= 1 << (v - 1)
+	return out
+
+
+@jit
+def _flip_delta(c):
+	if c == 1:
+		return 1
+	if c == 2:
+		return -1
+	return 0
+
+
+@jit
+def successors_batch(states, n):
+	"""
+	Next states of an array of states for every move of Board.MoveList, -1 where a move is not possible.
+	The columns follow the order of Board.MoveList: place, fr, fc, il, ir, it, ib.
+	"""
+	nn = n*n
+	n_moves = 2*nn + 10*n
+	out = np.empty((states.shape[0], n_moves), dtype=np.int64)
+	digits = np.empty(nn, dtype=np.int64)
+	powers = np.empty(nn, dtype=np.int64)
+	p = 1
+	for k in range(nn - 1, -1, -1):
+		powers[k] = p
+		p *= 3
+
+	for b in range(states.shape[0]):
+		s = states[b]
+		_unpack(s, digits)
+		j = 0
+
+		# Place
+		for k in range(nn):
+			for color in range(1, 3):
+				out[b, j] = s + color * powers[k] if digits[k] == 0 else -1
+				j += 1
+
+		# Flip rows, then columns
+		for row in range(n):
+			t = s
+			for col in range(n):
+				t += _flip_delta(digits[row*n + col]) * powers[row*n + col]
+			out[b, j] = t
+			j += 1
+		for col in range(n):
+			t = s
+			for row in range(n):
+				t += _flip_delta(digits[row*n + col]) * powers[row*n + col]
+			out[b, j] = t
+			j += 1
+
+		# Insert left, right, top, bottom
+		for kind in range(4):
+			for line in range(n):
+				for color in range(1, 3):
+					t = s
+					prev = color
+					for i in range(n):
+						if kind == 0:
+							k = line*n + i
+						elif kind == 1:
+							k = line*n + n - 1 - i
+						elif kind == 2:
+							k = i*n + line
+						else:
+							k = (n - 1 - i)*n + line
+						t += (prev - digits[k]) * powers[k]
+						prev = digits[k]
+					out[b, j] = t
+					j += 1
+
+	return out
+
+
+@jit(parallel=True)
+def canonical_states(states, symmetry_powers):
+	"""
+	Smallest of the 8 rotated/reflected images of each state, see Board.SymmetryCellPowers.
+	"""
+	nn, n_images = symmetry_powers.shape
+	out = np.empty(states.shape[0], dtype=np.int64)
+	chunk = 4096
+	for c in prange((states.shape[0] + chunk - 1) // chunk):
+		images = np.empty(n_images, dtype=np.int64)
+		for b in range(c*chunk, min((c + 1)*chunk, states.shape[0])):
+			images[:] = 0
+			s = states[b]
+			for k in range(nn - 1, -1, -1):
+				d = s % 3
+				s //= 3
+				if d:
+					for g in range(n_images):
+						images[g] += d * symmetry_powers[k, g]
+			out[b] = images.min()
+	return out
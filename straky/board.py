@@ -1,13 +1,84 @@
 import typing
 import random
-import itertools
+import functools
+import numpy as np
+from . import _fast
 
 
 class Board:
+	__slots__ = (
+		"N",
+		"CellPowers",
+		"CellPowersArray",
+		"RowPowers",
+		"RowSize",
+		"RowOnes",
+		"RowColumnColors",
+		"RowFlipDeltas",
+		"SymmetryPermutations",
+		"SymmetryCellPowers",
+		"SymmetryRowPowers",
+		"canonical_state",
+		"Moves",
+		"MoveGenerators",
+		"MoveArgs",
+		"MoveList",
+		"MoveIndex",
+		"MoveDescription",
+		"VizTemplate",
+	)
+
 	VizTiles = "_░█"
+	VizTileGlyphs = tuple(t*2 for t in VizTiles)
+	# Maps every accepted tile character to its base-3 digit
+	TileDigits = str.maketrans(VizTiles + "_XO", "012012")
+	# Difference made by inverting a single tile of each color, per unit of cell weight
+	CellFlipDeltas = (0, 1, -1)
 
 	def __init__(self, n):
 		self.N = n
+		# States are packed into a single int of N*N base-3 digits,
+		# with the top left cell as the most significant digit
+		self.CellPowers = tuple(3**(n*n - 1 - i) for i in range(n*n))
+		self.RowPowers = self.CellPowers[n-1::n]
+		# For packing arrays of tiles; falls back to Python ints once states overflow int64
+		self.CellPowersArray = np.array(self.CellPowers, dtype=np.int64 if 3**(n*n) <= 2**63 else object)
+		self.RowSize = 3**n
+		# Value of a row filled with color 1; color 2 is twice that
+		self.RowOnes = (3**n - 1) // 2
+		# For every row value, a bitmask of the columns holding color 1 (low N bits)
+		# and color 2 (high N bits)
+		self.RowColumnColors = tuple(
+			sum(1 << (n*(c-1) + col) for col, c in enumerate(number_to_base(r, 3, length=n)) if c)
+			for r in range(3**n)
+		)
+		# For every row value, the difference made by inverting all its tiles
+		self.RowFlipDeltas = tuple(
+			sum((-c % 3 - c) * 3**(n - 1 - col) for col, c in enumerate(number_to_base(r, 3, length=n)))
+			for r in range(3**n)
+		)
+		# Cell index permutations of the 8 rotations and reflections of the board
+		cells = np.arange(n*n).reshape(n, n)
+		self.SymmetryPermutations = np.stack([
+			cells, cells[::-1], cells[:, ::-1], cells[::-1, ::-1],
+			cells.T, cells.T[::-1], cells.T[:, ::-1], cells.T[::-1, ::-1],
+		]).reshape(8, n*n)
+		# Weight of every cell in each of the 8 images, so that `digits @ SymmetryCellPowers`
+		# packs all images of a board at once without gathering them first
+		self.SymmetryCellPowers = self.CellPowersArray[np.argsort(self.SymmetryPermutations, axis=1)].T.copy()
+		# SymmetryRowPowers[image][row][row value]: what a row contributes to the packed image,
+		# so one image of a single state costs N lookups instead of unpacking all digits
+		self.SymmetryRowPowers = tuple(
+			tuple(
+				tuple(
+					sum(c * powers[row*n + col] for col, c in enumerate(number_to_base(r, 3, length=n)))
+					for r in range(3**n)
+				)
+				for row in range(n)
+			)
+			for powers in self.SymmetryCellPowers.T.tolist()
+		)
+		self.canonical_state = functools.lru_cache(maxsize=2**22)(self._canonical_state)
 		self.Moves = {
 			"p": self.place,
 			"fr": self.flip_row,
@@ -17,6 +88,51 @@ class Board:
 			"it": self.insert_top,
 			"ib": self.insert_bottom,
 		}
+		self.MoveGenerators = {
+			"p": self._generate_place_moves,
+			"fr": self._generate_flip_row_moves,
+			"fc": self._generate_flip_column_moves,
+			"il": self._generate_insert_left_moves,
+			"ir": self._generate_insert_right_moves,
+			"it": self._generate_insert_top_moves,
+			"ib": self._generate_insert_bottom_moves,
+		}
+		# Move tuples allocated once and shared by every generated move (and Graph edge):
+		# MoveArgs["p"][cell][color], MoveArgs["fr" | "fc"][line], MoveArgs[<insert>][line][color]
+		self.MoveArgs = {
+			"p": tuple(
+				tuple(("p", i % n, i // n, color) for color in range(3))
+				for i in range(n*n)
+			),
+			"fr": tuple(("fr", i) for i in range(n)),
+			"fc": tuple(("fc", i) for i in range(n)),
+			**{
+				move: tuple(
+					tuple((move, i, color) for color in range(3))
+					for i in range(n)
+				)
+				for move in ("il", "ir", "it", "ib")
+			},
+		}
+		# Every move of either color, in the order used by successors_batch;
+		# _fast.successors_batch hard-codes this order
+		self.MoveList = (
+			tuple(self.MoveArgs["p"][i][color] for i in range(n*n) for color in (1, 2))
+			+ self.MoveArgs["fr"]
+			+ self.MoveArgs["fc"]
+			+ tuple(
+				self.MoveArgs[move][i][color]
+				for move in ("il", "ir", "it", "ib")
+				for i in range(n)
+				for color in (1, 2)
+			)
+		)
+		self.MoveIndex = {move: i for i, move in enumerate(self.MoveList)}
+		# Board visualization with a {} slot for every tile
+		self.VizTemplate = "  " + "".join("{} ".format(col_letter(i)) for i in range(n)) + "".join(
+			"\n{:<2}".format(row_number(row)) + "{}" * n
+			for row in range(n)
+		)
 		self.MoveDescription = {
 			"p": "Player {player} places tile {2} at column {0}, row {1}.",
 			"fr": "Player {player} flips row {0}.",
@@ -27,195 +143,237 @@ class Board:
 			"ib": "Player {player} inserts tile {1} at the bottom of column {0}.",
 		}
 
+	def __reduce__(self):
+		# Every table, including the per-instance canonical_state cache, is derived from N
+		return (Board, (self.N,))
+
 	def empty_state(self):
 		"""
 		Generate empty board state
 		"""
-		return tuple(0 for _ in range(self.N**2))
+		return 0
 
 	def random_state(self):
 		"""
 		Generate random board state
 		"""
-		return tuple(random.choice([0,1,2]) for _ in range(self.N**2))
+		return random.randrange(3**(self.N**2))
 
 	def state_from_string(self, s, tiles=None):
 		"""
 		Create state from string representation
 		"""
-		m = {t: i for i, t in itertools.chain(enumerate(self.VizTiles), enumerate("_XO"), enumerate("012"))}
 		if tiles:
 			assert len(tiles) == 3
 			assert " " not in tiles
 			assert "\n" not in tiles
-		return tuple(
-			m[t]
-			for t in s.strip().replace("\n", "")
-		)
-	
+		# The translated string is the state's base-3 representation
+		return int(s.strip().replace("\n", "").translate(self.TileDigits), 3)
+
+	def state_from_digits(self, digits) -> int:
+		"""
+		Pack a sequence of N*N tiles into a state
+		"""
+		s = 0
+		for c in digits:
+			s = s * 3 + c
+		return s
+
+	def state_to_digits(self, s) -> typing.Tuple[int]:
+		"""
+		Unpack a state into a tuple of N*N tiles
+		"""
+		return number_to_base(s, 3, length=self.N**2)
+
+	def states_to_digits(self, states) -> np.ndarray:
+		"""
+		Unpack an array of states into a (len(states), N*N) array of tiles
+		"""
+		states = np.array(states, dtype=np.int64)
+		digits = np.empty((len(states), self.N**2), dtype=np.uint8)
+		for i in range(self.N**2 - 1, -1, -1):
+			states, digits[:, i] = np.divmod(states, 3)
+		return digits
 	
 	def viz(self, s):
 		"""
 		Visualize board state
 		"""
-		out = []
-		out.append("  ")
-		for i in range(self.N):
-			out.append("{} ".format(col_letter(i)))
-		for i, f in enumerate(s):
-			if not i % self.N:
-				out.append("\n{:<2}".format(row_number(i // self.N)))
-			out.append(self.viz_tile(f))
-		return "".join(out)
+		return self.VizTemplate.format(*map(self.VizTileGlyphs.__getitem__, self.state_to_digits(s)))
 	
 	def viz_tile(self, tile):
 		"""
 		Visualize tile
 		"""
-		return self.VizTiles[tile]*2
+		return self.VizTileGlyphs[tile]
 
 	def rotate_board_left(self, s):
 		"""
 		Rotate the entire board 90 degrees to the left
 		"""
-		return tuple(
-			s[col*self.N+row]
-			for row in range(self.N)
-			for col in range(self.N-1, -1, -1)
-		)
+		# Image 6 of SymmetryPermutations, cells.T[:, ::-1]
+		return self._symmetric_image(s, 6)
 
 	def rotate_board_right(self, s):
 		"""
 		Rotate the entire board 90 degrees to the right
 		"""
-		return tuple(
-			s[col*self.N+row]
-			for row in range(self.N-1, -1, -1)
-			for col in range(self.N)
-		)
+		# Image 5 of SymmetryPermutations, cells.T[::-1]
+		return self._symmetric_image(s, 5)
 
 	def reflect_board_vertically(self, s):
 		"""
 		Flip the entire board horizontally
 		"""
-		return tuple(
-			s[col*self.N+row]
-			for col in range(self.N)
-			for row in range(self.N-1, -1, -1)
-		)
+		# Image 2 of SymmetryPermutations, cells[:, ::-1]
+		return self._symmetric_image(s, 2)
 
 	def reflect_board_horizontally(self, s):
 		"""
 		Flip the entire board horizontally
 		"""
-		return tuple(
-			s[col*self.N+row]
-			for col in range(self.N-1, -1, -1)
-			for row in range(self.N)
-		)
+		# Image 1 of SymmetryPermutations, cells[::-1]
+		return self._symmetric_image(s, 1)
 	
-	def generate_equivalent_states(self, s) -> typing.List[typing.Tuple[int]]:
+	def _symmetric_image(self, s, image):
 		"""
-		Generate a list of all possible rotated and reflected states which are equivalent to the input state.
+		Pack one of the 8 images of SymmetryPermutations from the rows of a state
 		"""
-		states = {s}
+		row_size = self.RowSize
+		t = 0
+		for row_powers in reversed(self.SymmetryRowPowers[image]):
+			s, r = divmod(s, row_size)
+			t += row_powers[r]
+		return t
 
-		# Mirror
-		s_ = self.reflect_board_vertically(s)
-		states.add(s_)
-		
-		# Rotations
-		for sx in [s, s_]:
-			for _ in range(3):
-				sx = self.rotate_board_left(sx)
-				states.add(sx)
+	def generate_equivalent_states(self, s) -> typing.List[int]:
+		"""
+		Generate a list of all possible rotated and reflected states which are equivalent to the input state.
+		"""
+		digits = np.array(self.state_to_digits(s), dtype=np.uint8)
+		states = set((digits @ self.SymmetryCellPowers).tolist())
+		return sorted(states)
 
-		# Sort
-		states = sorted(states)
-			
-		return states
+	def _canonical_state(self, s) -> int:
+		"""
+		Return the representative of the state's equivalence class, i.e. the smallest equivalent state.
+		Cached per board instance as `canonical_state`.
+		"""
+		digits = np.array(self.state_to_digits(s), dtype=np.uint8)
+		return min((digits @ self.SymmetryCellPowers).tolist())
 	
+	def canonical_states(self, states) -> np.ndarray:
+		"""
+		Vectorized canonical_state over an array of states
+		"""
+		if _fast.ENABLED:
+			return _fast.canonical_states(np.asarray(states, dtype=np.int64), self.SymmetryCellPowers)
+		return (self.states_to_digits(states) @ self.SymmetryCellPowers).min(axis=1)
+
+	def generate_canonical_states(self) -> typing.Generator[int]:
+		"""
+		Iterate through the canonical states (the smallest state of each equivalence class) in increasing order.
+		Boards are filled in cell by cell, and a partial board is pruned as soon as one of its rotated or
+		reflected images is known to be smaller, so non-canonical states are never visited.
+		"""
+		nn = self.N**2
+		digits = [0] * nn
+		# (depth, state, [(symmetry permutation, length of the prefix where image and state are equal)])
+		stack = [(0, 0, [(perm, 0) for perm in self.SymmetryPermutations[1:].tolist()])]
+
+		while stack:
+			k, s, symmetries = stack.pop()
+			if k:
+				digits[k-1] = s % 3
+			if k == nn:
+				yield s
+				continue
+
+			for c in (2, 1, 0):
+				digits[k] = c
+				remaining = []
+				for perm, i in symmetries:
+					# Compare image and state up to the first cell that is not assigned yet
+					while i <= k and perm[i] <= k:
+						if digits[perm[i]] != digits[i]:
+							break
+						i += 1
+					else:
+						remaining.append((perm, i))
+						continue
+					if digits[perm[i]] < digits[i]:
+						# Smaller image, not canonical
+						break
+					# Larger image, this symmetry can no longer produce a smaller state
+				else:
+					stack.append((k+1, s*3 + c, remaining))
+
 	def place(self, s, col, row, color):
 		"""
 		Place a tile at an empty position
 		"""
-		assert s[self.N*row+col] == 0
-		return tuple(
-			c if (i != self.N*row+col) else color
-			for i, c in enumerate(s)
-		)
+		p = self.CellPowers[self.N*row+col]
+		assert s // p % 3 == 0
+		return s + color * p
 
 	def flip_row(self, s, row):
 		"""
 		Invert all tiles in a selected row
 		"""
-		return tuple(
-			(-c % 3) if (i // self.N == row) else c
-			for i, c in enumerate(s)
-		)
+		p = self.RowPowers[row]
+		return s + self.RowFlipDeltas[s // p % self.RowSize] * p
 
 	def flip_column(self, s, col):
 		"""
 		Invert all tiles in a selected column
 		"""
-		return tuple(
-			(-c % 3) if (i % self.N == col) else c
-			for i, c in enumerate(s)
-		)
+		for p in self.CellPowers[col::self.N]:
+			s += self.CellFlipDeltas[s // p % 3] * p
+		return s
 
 	def insert_left(self, s, row, color):
 		"""
 		Insert a tile at the left side of a selected row, pushing the entire row to the right 
 		and discarding the rightmost tile.
 		"""
-		new = (
-			s[:self.N*row] 
-			+ (color,) + s[self.N*row:self.N*(row+1)-1] 
-			+ s[self.N*(row+1):]
-		)
-		return tuple(new)
+		row_size = self.RowSize
+		p = self.RowPowers[row]
+		r = s // p % row_size
+		return s + (color * (row_size // 3) + r // 3 - r) * p
 
 	def insert_right(self, s, row, color):
 		"""
 		Insert a tile at the right side of a selected row, pushing the entire row to the left 
 		and discarding the leftmost tile.
 		"""
-		new = (
-			s[:self.N*row] 
-			+ s[self.N*row+1:self.N*(row+1)] + (color,)
-			+ s[self.N*(row+1):]
-		)
-		return tuple(new)
+		row_size = self.RowSize
+		p = self.RowPowers[row]
+		r = s // p % row_size
+		return s + (r % (row_size // 3) * 3 + color - r) * p
 
 	def insert_top(self, s, col, color):
 		"""
 		Insert a tile at the top of a selected column, pushing the entire column down
 		and discarding the bottom-most tile.
 		"""
-		new = []
-		for i, c in enumerate(s):
-			if i % self.N != col:
-				new.append(c)
-			elif i < self.N:
-				new.append(color)
-			else:
-				new.append(s[i-self.N])
-		return tuple(new)
+		prev = color
+		for p in self.CellPowers[col::self.N]:
+			c = s // p % 3
+			s += (prev - c) * p
+			prev = c
+		return s
 
-	def insert_bottom(self, s, col, color) -> typing.Tuple[int]:
+	def insert_bottom(self, s, col, color) -> int:
 		"""
 		Insert a tile at the bottom of a selected column, pushing the entire column up
 		and discarding the topmost tile.
 		"""
-		new = []
-		for i, c in enumerate(s):
-			if i % self.N != col:
-				new.append(c)
-			elif i >= self.N*(self.N-1):
-				new.append(color)
-			else:
-				new.append(s[i+self.N])
-		return tuple(new)
+		prev = color
+		for p in reversed(self.CellPowers[col::self.N]):
+			c = s // p % 3
+			s += (prev - c) * p
+			prev = c
+		return s
 	
 	def get_winners(self, s) -> typing.Set[int]:
 		"""
@@ -224,73 +382,160 @@ class Board:
 		If there is exactly one winner, the set contains one element.
 		If the state is a tie, the set contains two elements.
 		"""
+		N = self.N
+		row_size = self.RowSize
+		ones = self.RowOnes
+		row_column_colors = self.RowColumnColors
+
 		winners = set()
-		# Rows
-		for row in range(self.N):
-			v = s[row*self.N]
-			if v == 0:
-				continue
-			for i in range(row*self.N+1, (row+1)*self.N):
-				if s[i] != v:
-					break
-			else:
-				winners.add(v)
+		columns = (1 << 2*N) - 1
+		for _ in range(N):
+			s, r = divmod(s, row_size)
+			# Rows
+			if r == ones:
+				winners.add(1)
+			elif r == 2*ones:
+				winners.add(2)
+			# Columns: keep only those with the same color in every row so far
+			columns &= row_column_colors[r]
 
-		# Columns
-		for col in range(self.N):
-			v = s[col]
-			if v == 0:
-				continue
-			for i in range(1, self.N):
-				if s[col + i*self.N] != v:
-					break
-			else:
-				winners.add(v)
+		if columns & ((1 << N) - 1):
+			winners.add(1)
+		if columns >> N:
+			winners.add(2)
 
 		return winners
 	
+	def get_winners_batch(self, states) -> np.ndarray:
+		"""
+		Check an array of states for winners at once.
+		Returns an array of winner bitsets: bit 0 is set if color 1 wins, bit 1 if color 2 wins.
+		"""
+		states = np.asarray(states, dtype=np.int64)
+		if _fast.ENABLED:
+			return _fast.get_winners_batch(states, self.N)
+
+		digits = self.states_to_digits(states).reshape(-1, self.N, self.N)
+		winners = np.zeros(len(states), dtype=np.uint8)
+		for color in (1, 2):
+			owned = digits == color
+			won = owned.all(axis=2).any(axis=1) | owned.all(axis=1).any(axis=1)
+			winners |= won.astype(np.uint8) << (color - 1)
+		return winners
+
 	def generate_possible_moves(
 		self, 
 		s, 
 		colors=frozenset({1, 2}), 
 		moves=frozenset({"p", "fr", "fc", "il", "ir", "it", "ib"}),
-	) -> typing.Generator[typing.Tuple[typing.Tuple, typing.Tuple[int]]]:
+	) -> typing.Generator[typing.Tuple[typing.Tuple, int]]:
 		"""
 		Iterate through all possible moves from a given state.
 		"""
+		move_generators = self.MoveGenerators
 		for move in moves:
-			# Place
-			if move == "p":
-				for col, row, color in itertools.product(range(self.N), range(self.N), colors):
-					if s[self.N*row+col] != 0:
-						# Not empty
-						continue
-					s_next = self.Moves[move](s, col, row, color)
-					move_args = (move, col, row, color)
-					yield (move_args, s_next)
-			
-			# Flip
-			elif move in {"fr", "fc"}:
-				for i in range(self.N):
-					s_next = self.Moves[move](s, i)
-					move_args = (move, i)
-					yield (move_args, s_next)
-			
-			# Insert
-			elif move in {"il", "ir", "it", "ib"}:
-				for i, color in itertools.product(range(self.N), colors):
-					s_next = self.Moves[move](s, i, color)
-					move_args = (move, i, color)
-					yield (move_args, s_next)
-
-			else:
+			generator = move_generators.get(move)
+			if generator is None:
 				raise ValueError(f"Unknown move: {move}")
+			yield from generator(s, colors)
+
+	def _generate_place_moves(self, s, colors):
+		N = self.N
+		cell_powers = self.CellPowers
+		move_args = self.MoveArgs["p"]
+		for col in range(N):
+			for row in range(N):
+				p = cell_powers[N*row+col]
+				if s // p % 3 != 0:
+					# Not empty
+					continue
+				for color in colors:
+					yield (move_args[N*row+col][color], s + color * p)
+
+	def _generate_flip_row_moves(self, s, colors):
+		row_size = self.RowSize
+		row_flip_deltas = self.RowFlipDeltas
+		move_args = self.MoveArgs["fr"]
+		for row, p in enumerate(self.RowPowers):
+			yield (move_args[row], s + row_flip_deltas[s // p % row_size] * p)
+
+	def _generate_flip_column_moves(self, s, colors):
+		flip_column = self.flip_column
+		move_args = self.MoveArgs["fc"]
+		for col in range(self.N):
+			yield (move_args[col], flip_column(s, col))
+
+	def _generate_insert_left_moves(self, s, colors):
+		row_size = self.RowSize
+		move_args = self.MoveArgs["il"]
+		for row, p in enumerate(self.RowPowers):
+			r = s // p % row_size
+			for color in colors:
+				yield (move_args[row][color], s + (color * (row_size // 3) + r // 3 - r) * p)
+
+	def _generate_insert_right_moves(self, s, colors):
+		row_size = self.RowSize
+		move_args = self.MoveArgs["ir"]
+		for row, p in enumerate(self.RowPowers):
+			r = s // p % row_size
+			for color in colors:
+				yield (move_args[row][color], s + (r % (row_size // 3) * 3 + color - r) * p)
+
+	def _generate_insert_top_moves(self, s, colors):
+		insert_top = self.insert_top
+		move_args = self.MoveArgs["it"]
+		for col in range(self.N):
+			for color in colors:
+				yield (move_args[col][color], insert_top(s, col, color))
+
+	def _generate_insert_bottom_moves(self, s, colors):
+		insert_bottom = self.insert_bottom
+		move_args = self.MoveArgs["ib"]
+		for col in range(self.N):
+			for color in colors:
+				yield (move_args[col][color], insert_bottom(s, col, color))
 			
+	def all_successors(
+		self,
+		s,
+		colors=frozenset({1, 2}),
+	) -> typing.Tuple[typing.List[typing.Tuple], np.ndarray]:
+		"""
+		Compute all possible moves from a given state at once, as one row of successors_batch.
+		Returns the list of moves and an array of the corresponding next states.
+		"""
+		row = self.successors_batch([s])[0]
+		keep = [
+			s_next >= 0 and (move[0] in ("fr", "fc") or move[-1] in colors)
+			for move, s_next in zip(self.MoveList, row.tolist())
+		]
+		return [move for move, k in zip(self.MoveList, keep) if k], row[keep]
+
+	def successors_batch(self, states) -> np.ndarray:
+		"""
+		Compute the next state for every move in MoveList from an array of states at once.
+		Returns a (len(states), len(MoveList)) array, with -1 where a move is not possible.
+		"""
+		states = np.asarray(states, dtype=np.int64)
+		if _fast.ENABLED:
+			out = _fast.successors_batch(states, self.N)
+			# The kernel lays out its columns on its own; it must agree with MoveList
+			assert out.shape[1] == len(self.MoveList)
+			return out
+
+		out = np.full((len(states), len(self.MoveList)), -1, dtype=np.int64)
+		move_index = self.MoveIndex
+		generate_possible_moves = self.generate_possible_moves
+		for b, s in enumerate(states.tolist()):
+			for move, s_next in generate_possible_moves(s):
+				out[b, move_index[move]] = s_next
+		return out
+
 	def exclude_forbidden_moves(
 		self,
 		state_generator, 
 		forbidden_states=frozenset(),
-	) -> typing.Generator[typing.Tuple[typing.Tuple, typing.Tuple[int]]]:
+	) -> typing.Generator[typing.Tuple[typing.Tuple, int]]:
 		for m, s in state_generator:
 			if s in forbidden_states:
 				continue
@@ -352,7 +597,7 @@ class Board:
 			if not p.Color:
 				p.set_color(i + 1)
 
-		if not s:
+		if s is None:
 			s = self.empty_state()
 
 		player_i = 2
@@ -396,3 +641,14 @@ def col_letter(i):
 
 def row_number(i):
 	return i + 1
+
+
+def number_to_base(n, b, length):
+	# Fills the digits from the least significant end
+	digits = [0] * length
+	n = int(n)
+	i = length - 1
+	while n:
+		n, digits[i] = divmod(n, b)
+		i -= 1
+	return tuple(digits)
@@ -1,88 +1,259 @@
 import itertools
+import functools
+import contextlib
+import multiprocessing
+import zipfile
+import warnings
+import numpy as np
 from .board import Board
+from . import _fast
 
 
 class GameGraph:
 	def __init__(self, board: Board):
 		self.Board = board
 		self.NormalizedStates = None
-		self.Graph = None
+		# Whether NormalizedStates only maps the states of the built graph (others hold the sentinel)
+		self.NormalizedStatesReachableOnly = False
+		# CSR graph: the edges of state id i are EdgeMoves[Indptr[i]:Indptr[i + 1]] (indices into
+		# Board.MoveList) and EdgeStates[Indptr[i]:Indptr[i + 1]] (next state ids)
+		self.States = None
+		self.StateIds = None
+		self.Indptr = None
+		self.EdgeMoves = None
+		self.EdgeStates = None
 		self.Terminals = None
 
-	def prepare_normalized_states(self):
-		self.NormalizedStates = {}  # state -> normalized_state
+	def prepare_normalized_states(self, batch_size=2**18, processes=1, reachable_only=False):
+		"""
+		Map every state to its canonical form, or only the states of the built graph with reachable_only.
+		Worker processes are only used for the full table.
+		"""
+		if reachable_only and self.States is None:
+			raise ValueError("reachable_only needs the graph, call build_graph first")
+		n_states = 3**(self.Board.N**2)
+		dtype = np.min_scalar_type(n_states)
+		self.NormalizedStatesReachableOnly = reachable_only
 
-		for i, s in enumerate(itertools.product(range(3), repeat=self.Board.N**2)):
-			if not i % 1000000:
-				print(i)
-			if s in self.NormalizedStates:
-				continue
-			eqs = self.Board.generate_equivalent_states(s)
-			for s_ in eqs:
-				self.NormalizedStates[s_] = eqs[0]
+		if not reachable_only and (processes > 1 or _fast.ENABLED):
+			# Canonicalize every state in contiguous ranges, spread over worker processes if requested.
+			# With the compiled kernel this is cheaper than enumerating canonical states in Python.
+			self.NormalizedStates = np.empty(n_states, dtype=dtype)
+			ranges = [(start, min(start + batch_size, n_states), dtype) for start in range(0, n_states, batch_size)]
+			if processes > 1:
+				# Spawn rather than fork: Numba's threading layer is not fork-safe
+				pool = multiprocessing.get_context("spawn").Pool(
+					processes, initializer=_init_worker, initargs=(self.Board.N,)
+				)
+			else:
+				pool = contextlib.nullcontext()
+			with pool:
+				if processes > 1:
+					results = pool.imap_unordered(_normalize_range, ranges)
+				else:
+					results = map(functools.partial(_normalize_range, board=self.Board), ranges)
+				# Progress as the number of completed states, about once per million;
+				# ranges complete out of order with worker processes
+				done = 0
+				print(done)
+				for start, normalized in results:
+					self.NormalizedStates[start:start + len(normalized)] = normalized
+					done += len(normalized)
+					if done // 10**6 > (done - len(normalized)) // 10**6:
+						print(done)
+			return
+
+		symmetry_powers = self.Board.SymmetryCellPowers
+		if reachable_only:
+			canonical_states = iter(self.States.tolist())
+		else:
+			canonical_states = self.Board.generate_canonical_states()
+
+		# state -> normalized_state; unmapped states hold the out-of-range value 3**(N*N),
+		# which only remain with reachable_only: the canonical states cover every orbit
+		self.NormalizedStates = np.full(n_states, n_states, dtype=dtype)
+
+		n_canonical = 0
+		while True:
+			print(n_canonical)
+			batch = np.fromiter(itertools.islice(canonical_states, batch_size), dtype=np.int64)
+			if not len(batch):
+				break
+			n_canonical += len(batch)
+
+			# All 8 rotations and reflections of each canonical state
+			images = self.Board.states_to_digits(batch) @ symmetry_powers
+			self.NormalizedStates[images] = batch[:, None]
 
 	def save_normalized_states(self, fname):
-		assert self.NormalizedStates
+		assert self.NormalizedStates is not None
 
-		with open(fname, "w") as f:
-			for k, v in self.NormalizedStates.items():
-				if k == v:
-					continue
-				print("{} {}".format(
-					int("".join(str(c) for c in k), 3),
-					int("".join(str(c) for c in v), 3)
-				), file=f)
+		with open(fname, "wb") as f:
+			np.savez_compressed(
+				f,
+				normalized_states=self.NormalizedStates,
+				reachable_only=self.NormalizedStatesReachableOnly,
+			)
 
 	def load_normalized_states(self, fname):
-		self.NormalizedStates = {}
-		with open(fname) as f:
-			for line in f:
-				k, v = line.split(" ")
-				self.NormalizedStates[number_to_base(int(k), 3, length=self.Board.N**2)] = number_to_base(int(v), 3, length=self.Board.N**2)
+		if not zipfile.is_zipfile(fname):
+			return self._load_text_normalized_states(fname)
+		with open(fname, "rb") as f:
+			data = np.load(f)
+			self.NormalizedStates = data["normalized_states"]
+			if "reachable_only" in data:
+				self.NormalizedStatesReachableOnly = bool(data["reachable_only"])
+			else:
+				# Saved without the flag; a partial table still has sentinel entries
+				self.NormalizedStatesReachableOnly = bool((self.NormalizedStates == len(self.NormalizedStates)).any())
+		return self.NormalizedStates
+
+	def _load_text_normalized_states(self, fname):
+		"""
+		Legacy text format: one "state normalized_state" pair per line, identity pairs omitted
+		"""
+		n_states = 3**(self.Board.N**2)
+		# An empty file (no non-identity pairs) is valid; it loads as shape (0, 1)
+		with warnings.catch_warnings():
+			warnings.filterwarnings("ignore", "loadtxt: input contained no data")
+			data = np.loadtxt(fname, dtype=np.int64, ndmin=2).reshape(-1, 2)
+		self.NormalizedStates = np.arange(n_states, dtype=np.min_scalar_type(n_states))
+		self.NormalizedStates[data[:, 0]] = data[:, 1]
+		self.NormalizedStatesReachableOnly = False
 		return self.NormalizedStates
 	
 	def normalize_state(self, s):
-		if s not in self.NormalizedStates:
-			return s
-		return self.NormalizedStates[s]
+		normalized_states = self.NormalizedStates
+		if normalized_states is not None:
+			# One lookup that yields a Python int, no intermediate NumPy scalar
+			s_norm = normalized_states.item(s)
+			if s_norm != len(normalized_states):
+				return s_norm
+		# No table, or a table prepared for reachable states only
+		return self.Board.canonical_state(s)
 	
-	def build_graph(self):
+	def normalize_states(self, states) -> np.ndarray:
+		"""
+		Vectorized normalize_state over an array of states
+		"""
+		if self.NormalizedStates is None:
+			return self.Board.canonical_states(states)
+		normalized = self.NormalizedStates[states].astype(np.int64)
+		unmapped = normalized == len(self.NormalizedStates)
+		normalized[unmapped] = self.Board.canonical_states(states[unmapped])
+		return normalized
+
+	def build_graph(self, batch_size=2**14):
 		# TODO: use networkx
-		assert self.NormalizedStates is not None
+		# Drop the dict view of a previous build
+		self.__dict__.pop("Graph", None)
+		n_states = 3**(self.Board.N**2)
+		# state -> id in order of discovery, -1 for states not reached yet
+		self.StateIds = np.full(n_states, -1, dtype=np.int32)
+		self.Terminals = terminals = {}
+		states = []
+		edge_counts = []
+		edge_moves = []
+		edge_states = []
+		move_dtype = np.min_scalar_type(len(self.Board.MoveList))
 
-		self.Graph = {}  # state -> ((move, *args) -> state)
-		self.Terminals = {}
+		# Level-synchronous BFS: each level of the frontier is expanded in batches of states
+		level = np.array([self.Board.empty_state()], dtype=np.int64)
+		self.StateIds[level] = 0
+		n_seen = 1
+		while len(level):
+			states.append(level)
+			next_level = []
+			for start in range(0, len(level), batch_size):
+				batch = level[start:start + batch_size]
 
-		s_init = self.Board.empty_state()
-		frontier = {s_init}
+				# Terminal states; winner bit c-1 is set for color c, so the bit values are the colors
+				winners = self.Board.get_winners_batch(batch)
+				terminal = winners != 0
+				for s, w in zip(batch[terminal].tolist(), winners[terminal].tolist()):
+					terminals[s] = {c for c in (1, 2) if w & c}
 
-		while frontier:
-			s = frontier.pop()
+				# Next states for every move, -1 where the move is not possible
+				successors = self.Board.successors_batch(batch[~terminal])
+				possible = successors >= 0
+				next_states = self.normalize_states(successors[possible])
+				counts = np.zeros(len(batch), dtype=np.int64)
+				counts[~terminal] = possible.sum(axis=1)
+				edge_counts.append(counts)
+				# Row-major order, the same as the boolean mask selection
+				edge_moves.append(np.nonzero(possible)[1].astype(move_dtype))
+				next_level.append(next_states)
 
-			# Check if state is terminal
-			winners = self.Board.get_winners(s)
-			if winners:
-				self.Graph[s] = None
-				self.Terminals[s] = winners
+			# Add unexplored
+			level = np.unique(np.concatenate(next_level))
+			level = level[self.StateIds[level] < 0]
+			self.StateIds[level] = np.arange(n_seen, n_seen + len(level))
+			n_seen += len(level)
+			# Every next state of this level has an id now
+			edge_states.extend(self.StateIds[next_states] for next_states in next_level)
+
+		self.States = np.concatenate(states)
+		self.Indptr = np.zeros(len(self.States) + 1, dtype=np.int64)
+		np.cumsum(np.concatenate(edge_counts), out=self.Indptr[1:])
+		self.EdgeMoves = np.concatenate(edge_moves)
+		self.EdgeStates = np.concatenate(edge_states)
+
+	def successors(self, state_id):
+		"""
+		Moves (indices into Board.MoveList) and next state ids of a state id
+		"""
+		start, stop = self.Indptr[state_id], self.Indptr[state_id + 1]
+		return self.EdgeMoves[start:stop], self.EdgeStates[start:stop]
+
+	def successors_of_state(self, s):
+		"""
+		Next states of a state by move, or None for terminal states; reads the CSR arrays directly
+		"""
+		state_id = self.StateIds.item(s)
+		if state_id < 0:
+			raise KeyError(s)
+		if s in self.Terminals:
+			return None
+		moves, next_ids = self.successors(state_id)
+		move_list = self.Board.MoveList
+		return dict(zip(
+			[move_list[m] for m in moves.tolist()],
+			self.States[next_ids].tolist(),
+		))
+
+	@functools.cached_property
+	def Graph(self):
+		"""
+		Dict view of the CSR graph, state -> ((move, *args) -> state) or None for terminal states.
+		It is built on first access after build_graph; for large graphs use successors_of_state.
+		"""
+		if self.States is None:
+			return None
+		move_list = self.Board.MoveList
+		indptr = self.Indptr.tolist()
+		edge_moves = self.EdgeMoves.tolist()
+		edge_states = self.States[self.EdgeStates].tolist()
+		graph = {}
+		for i, s in enumerate(self.States.tolist()):
+			if s in self.Terminals:
+				graph[s] = None
 				continue
+			graph[s] = {
+				move_list[edge_moves[j]]: edge_states[j]
+				for j in range(indptr[i], indptr[i + 1])
+			}
+		return graph
+
+
+_worker_board = None
+
+
+def _init_worker(n):
+	global _worker_board
+	_worker_board = Board(n)
+
 
-			for move, s_next in self.Board.generate_possible_moves(s):
-				s_next = self.normalize_state(s_next)
-				if s not in self.Graph:
-					self.Graph[s] = {}
-				self.Graph[s][move] = s_next
-
-				# Add unexplored
-				if s_next not in self.Graph:
-					frontier.add(s_next)
-
-
-def number_to_base(n, b, length):
-	# https://stackoverflow.com/questions/2267362/how-to-convert-an-integer-to-a-string-in-any-base
-	digits = []
-	while n:
-		digits.append(int(n % b))
-		n //= b
-	while len(digits) < length:
-		digits.append(0)
-	return tuple(digits[::-1])
+def _normalize_range(task, board=None):
+	start, stop, dtype = task
+	states = np.arange(start, stop, dtype=np.int64)
+	return start, (board or _worker_board).canonical_states(states).astype(dtype)
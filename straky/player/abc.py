@@ -1,9 +1,8 @@
 import typing
-import abc
 from ..board import Board
 
 
-class PlayerABC(abc.ABC):
+class PlayerABC:
 	def __init__(self, *, board = None, color = None, **kwargs):
 		self.Board: typing.Optional[Board] = board
 		self.Color: typing.Optional[int] = color
@@ -1,7 +1,10 @@
 import random
+import itertools
 from .abc import PlayerABC
 
 
 class PlayerRandom(PlayerABC):
 	def make_move(self, s, moves):
-		return random.choice(list(moves))
+		# Skip to a random key instead of copying all of them into a list
+		i = random.randrange(len(moves))
+		return next(itertools.islice(moves, i, None))
@@ -1,13 +1,22 @@
 import re
+import functools
 from .abc import PlayerABC
 
 
+_COORD_RE = re.compile(r"\A([a-zA-Z])([0-9]+)\Z")
+
+
 class PlayerTextInput(PlayerABC):
 	def make_move(self, s, moves):
 		move = self.parse_user_input(input("> "))
 		return move
 	
 	def parse_user_input(self, user_input):
+		return self._parse_cached(user_input, self.Color)
+
+	@staticmethod
+	@functools.lru_cache(maxsize=256)
+	def _parse_cached(user_input, color):
 		command = user_input.strip().split(" ")
 
 		if command[0] == "flip":
@@ -38,7 +47,7 @@ class PlayerTextInput(PlayerABC):
 					move = "it"
 				else:
 					raise ValueError(f"Unknown command: {user_input}")
-				return (move, col, self.Color)
+				return (move, col, color)
 			elif what.isdigit():
 				row = int(what) - 1
 				if where == "left":
@@ -47,19 +56,19 @@ class PlayerTextInput(PlayerABC):
 					move = "il"
 				else:
 					raise ValueError(f"Unknown command: {user_input}")
-				return (move, row, self.Color)
+				return (move, row, color)
 			else:
 				raise ValueError(f"Unknown command: {user_input}")
 			
 		elif len(command) == 1:
-			match = re.match("([a-zA-Z])([0-9]+)", command[0])
+			match = _COORD_RE.match(command[0])
 			if not match:
 				raise ValueError(f"Unknown command: {user_input}")
 			col, row = match.groups()
 			col = ord(col.upper()) - ord("A")
 			row = int(row) - 1
 			move = "p"
-			return (move, col, row, self.Color)
+			return (move, col, row, color)
 		
 		else:
 			raise ValueError(f"Unknown command: {user_input}")
@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+import numpy as np
+from straky import Board
+from straky import _fast
+
+
+class TestFastKernels(unittest.TestCase):
+	"""
+	The batch kernels in straky._fast must agree with the NumPy / pure Python fallbacks of Board.
+	Without Numba the kernels run as plain Python, so this also holds them to the fallbacks.
+	"""
+	def random_states(self, n, size=500):
+		rng = np.random.default_rng(n)
+		states = rng.integers(0, 3**(n*n), size=size, dtype=np.int64)
+		return np.concatenate([[0, 3**(n*n) - 1], states])
+
+	def test_successors_batch(self):
+		for n in range(2, 5):
+			with self.subTest(n=n):
+				board = Board(n)
+				states = self.random_states(n)
+				with mock.patch.object(_fast, "ENABLED", False):
+					expected = board.successors_batch(states)
+				np.testing.assert_array_equal(_fast.successors_batch(states, n), expected)
+
+	def test_get_winners_batch(self):
+		for n in range(2, 5):
+			with self.subTest(n=n):
+				board = Board(n)
+				states = self.random_states(n)
+				with mock.patch.object(_fast, "ENABLED", False):
+					expected = board.get_winners_batch(states)
+				np.testing.assert_array_equal(_fast.get_winners_batch(states, n), expected)
+				# Bit c-1 is set for color c
+				self.assertEqual(
+					[{c for c in (1, 2) if w & c} for w in expected.tolist()],
+					[board.get_winners(s) for s in states.tolist()],
+				)
+
+	def test_canonical_states(self):
+		for n in range(2, 5):
+			with self.subTest(n=n):
+				board = Board(n)
+				states = self.random_states(n)
+				with mock.patch.object(_fast, "ENABLED", False):
+					expected = board.canonical_states(states)
+				np.testing.assert_array_equal(_fast.canonical_states(states, board.SymmetryCellPowers), expected)
+				self.assertEqual(expected.tolist(), [board.canonical_state(s) for s in states.tolist()])
+
+
+if __name__ == "__main__":
+	unittest.main()